@@ -1,7 +1,11 @@
 import numpy as np
 import math
+from typing import Iterator
+from utils_jit import NUMBA_AVAILABLE, merge_intersect_kernel
 
 class BoundingBox:
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'score')
+
     def __init__(self, x1: int, y1: int, x2: int, y2: int, score: float = 0.0):
         """
         Initialize a BoundingBox object with the provided coordinates.
@@ -108,13 +112,60 @@ class BoundingBox:
 
 
 class BoundingBoxes:
-    def __init__(self, boxes: list[BoundingBox] = None):
+    __slots__ = ('_coords', '_scores', '_size')
+
+    def __init__(self, boxes: list[BoundingBox] = None, coords: np.ndarray = None, scores: np.ndarray = None):
         """
-        Initialize a BoundingBoxes object containing a list of BoundingBox objects.
+        Initialize a BoundingBoxes object backed by coordinate and score arrays.
+
+        The boxes are stored as an (N, 4) array of [x1, y1, x2, y2] rows and an (N,)
+        array of scores. BoundingBox objects are only built when the collection is
+        iterated or get_all_boxes() is called.
 
         @params boxes: A list of BoundingBox objects (optional).
+        @params coords: An (N, 4) array of [x1, y1, x2, y2] rows (optional, used when boxes is None).
+        @params scores: An (N,) array of confidence scores matching coords (optional, defaults to 0.0).
         """
-        self.boxes = boxes if boxes is not None else []
+        if boxes is not None:
+            coords = [[b.x1, b.y1, b.x2, b.y2] for b in boxes]
+            scores = [b.score for b in boxes]
+        coords = np.asarray(coords if coords is not None else [], dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores if scores is not None else np.zeros(len(coords)), dtype=np.float64).reshape(-1)
+
+        self._size = len(coords)
+        self._coords = coords.copy()
+        self._scores = scores.copy()
+
+    @property
+    def coords(self) -> np.ndarray:
+        """
+        The (N, 4) array of [x1, y1, x2, y2] rows of the collection.
+        """
+        return self._coords[:self._size]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """
+        The (N,) array of confidence scores of the collection.
+        """
+        return self._scores[:self._size]
+
+    def _reserve(self, capacity: int) -> None:
+        """
+        Grow the backing arrays so they can hold at least the given number of boxes.
+
+        @params capacity: The number of boxes the collection must be able to hold.
+
+        @return: None
+        """
+        if capacity <= len(self._coords):
+            return
+        capacity = max(capacity, 2 * len(self._coords), 8)
+        coords = np.empty((capacity, 4), dtype=np.float64)
+        scores = np.empty(capacity, dtype=np.float64)
+        coords[:self._size] = self.coords
+        scores[:self._size] = self.scores
+        self._coords, self._scores = coords, scores
 
     def add_box(self, box: BoundingBox) -> None:
         """
@@ -124,39 +175,142 @@ class BoundingBoxes:
         
         @return: None
         """
-        self.boxes.append(box)
+        self._reserve(self._size + 1)
+        self._coords[self._size] = (box.x1, box.y1, box.x2, box.y2)
+        self._scores[self._size] = box.score
+        self._size += 1
+
+    def add_boxes(self, boxes: 'BoundingBoxes') -> None:
+        """
+        Add all boxes of another BoundingBoxes object to the collection.
+
+        @params boxes: The BoundingBoxes object whose boxes are added.
+
+        @return: None
+        """
+        count = len(boxes)
+        self._reserve(self._size + count)
+        self._coords[self._size:self._size + count] = boxes.coords
+        self._scores[self._size:self._size + count] = boxes.scores
+        self._size += count
+
+    @classmethod
+    def from_relative(cls, detected_box_coordinates: np.ndarray, candidate_block_coordinate: list[int], scores: np.ndarray) -> 'BoundingBoxes':
+        """
+        Create a BoundingBoxes object from relative coordinates within a candidate block.
+
+        @params detected_box_coordinates: An (N, 4) array of [x1, y1, x2, y2] rows
+                                          representing the bounding boxes' relative coordinates.
+        @params candidate_block_coordinate: A list of 2 or 4 integers [x1, y1, x2, y2] or [x, y]
+                                            representing the candidate block's coordinates.
+        @params scores: An (N,) array of confidence scores of the detected bounding boxes.
+
+        @return: A new BoundingBoxes object with absolute coordinates.
+        """
+        block_x, block_y = candidate_block_coordinate[:2]
+        offset = np.array([block_x, block_y, block_x, block_y], dtype=np.float64)
+        return cls(coords=np.asarray(detected_box_coordinates, dtype=np.float64) + offset, scores=scores)
+
+    def scale(self, factor: float) -> None:
+        """
+        Scale the coordinates of all boxes by the given factor.
+
+        @params factor: The factor to multiply the coordinates with.
+
+        @return: None (the bounding boxes are scaled in-place).
+        """
+        self._coords[:self._size] *= factor
+
+    @staticmethod
+    def _union_find_merge(coords: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Merge each connected component of intersecting boxes into a single box.
+
+        @params coords: An (N, 4) array of [x1, y1, x2, y2] rows.
+        @params scores: An (N,) array of confidence scores.
+
+        @return: A tuple (coords, scores) with one enclosing box per component.
+        """
+        n = len(coords)
+        x1, y1, x2, y2 = coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]
+        inter = ((x2[:, None] >= x1[None, :]) & (x1[:, None] <= x2[None, :]) &
+                 (y2[:, None] >= y1[None, :]) & (y1[:, None] <= y2[None, :]))
+
+        # Union-find over the upper triangle of the intersection mask
+        parent = list(range(n))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in np.argwhere(np.triu(inter, 1)):
+            root_i, root_j = find(int(i)), find(int(j))
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        roots = np.array([find(i) for i in range(n)])
+        _, labels = np.unique(roots, return_inverse=True)
+        num_groups = int(labels.max()) + 1
+        if num_groups == n:
+            return coords, scores
+
+        # Reduce each component to its enclosing box and highest score
+        order = np.argsort(labels, kind='stable')
+        starts = np.searchsorted(labels[order], np.arange(num_groups))
+        sorted_coords, sorted_scores = coords[order], scores[order]
+        merged = np.hstack([
+            np.minimum.reduceat(sorted_coords[:, :2], starts, axis=0),
+            np.maximum.reduceat(sorted_coords[:, 2:], starts, axis=0),
+        ])
+        return merged, np.maximum.reduceat(sorted_scores, starts)
 
     def merge_intersection(self) -> None:
         """
         Merge intersecting bounding boxes in the collection.
 
-        This method iterates over the list of BoundingBox objects, checking each pair 
-        to see if they intersect. If two boxes intersect, they are merged into a single 
-        BoundingBox that encompasses the area of both original boxes. This process is 
-        repeated until no further intersections are found, resulting in a list of 
-        non-intersecting BoundingBox objects.
+        Intersecting boxes are merged into a single BoundingBox that encompasses the
+        area of both original boxes and keeps the highest score. When numba is
+        installed this runs as a compiled sweep-line over the boxes sorted by x1;
+        otherwise the pairwise intersection mask is computed with NumPy broadcasting
+        and each connected component is reduced at once. Since merged boxes can grow
+        into each other, this process is repeated until no further intersections are
+        found, resulting in a list of non-intersecting BoundingBox objects. On both
+        paths the merged boxes are ordered by the first box of each group.
 
         @return: None (the bounding boxes are merged in-place).
         """
-        merged_boxes = []
-        while self.boxes:
-            current_box = self.boxes.pop(0)
-            i = 0
-            while i < len(self.boxes):
-                if current_box.intersects(self.boxes[i]):
-                    current_box = current_box.merge(self.boxes.pop(i))
-                else:
-                    i += 1
-            merged_boxes.append(current_box)
-        self.boxes = merged_boxes
+        coords, scores = self.coords, self.scores
+        if NUMBA_AVAILABLE:
+            coords, scores = merge_intersect_kernel(coords, scores)
+        else:
+            while len(coords) > 1:
+                num_boxes = len(coords)
+                coords, scores = self._union_find_merge(coords, scores)
+                if len(coords) == num_boxes:
+                    break
+
+        self._size = len(coords)
+        self._coords = np.array(coords, dtype=np.float64)
+        self._scores = np.array(scores, dtype=np.float64)
+
+    def get_all_boxes(self) -> Iterator[BoundingBox]:
+        """
+        Get all BoundingBox objects, built lazily from the coordinate arrays.
+
+        @return: An iterator of BoundingBox objects.
+        """
+        return iter(self)
 
-    def get_all_boxes(self) -> list[BoundingBox]:
+    def __iter__(self) -> Iterator[BoundingBox]:
         """
-        Get the list of all BoundingBox objects.
+        Iterate over the collection, building a BoundingBox object for each box.
 
-        @return: A list of BoundingBox objects.
+        @return: An iterator of BoundingBox objects.
         """
-        return self.boxes
+        for row, score in zip(self.coords.tolist(), self.scores.tolist()):
+            yield BoundingBox(*row, score)
 
     def __len__(self) -> int:
         """
@@ -164,7 +318,7 @@ class BoundingBoxes:
 
         @return: The number of BoundingBox objects.
         """
-        return len(self.boxes)
+        return self._size
 
     def __repr__(self) -> str:
         """
@@ -172,4 +326,4 @@ class BoundingBoxes:
 
         @return: A string that represents the BoundingBoxes collection.
         """
-        return f"BoundingBoxes({len(self.boxes)} boxes)"
+        return f"BoundingBoxes({self._size} boxes)"
@@ -1,53 +1,332 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import layoutparser as lp
-import math
+import torch
+from detectron2.modeling.postprocessing import detector_postprocess
+from detectron2.structures import Boxes, Instances
 from bounding_box import BoundingBox, BoundingBoxes  # Import BoundingBox and BoundingBoxes classes
 
+MIN_REDETECT_AREA: int = 256 * 256
+LAYOUT_CACHE_SIZE: int = 64
+
+# Per-model LRU caches of detected layouts, keyed by image content (see enable_layout_cache)
+_layout_caches = weakref.WeakKeyDictionary()
+_layout_cache_lock = threading.Lock()
+
+class _LayoutCache(OrderedDict):
+    """
+    LRU mapping from image keys to detected layouts, holding at most maxsize entries.
+    """
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+def enable_layout_cache(model: lp.models.Detectron2LayoutModel, maxsize: int = LAYOUT_CACHE_SIZE) -> None:
+    """
+    Cache the layouts detected by the model, keyed by image content.
+
+    Useful when many pages are processed with the same model and some of them (or
+    some of their crops) repeat, e.g. identical cover pages. Every detection then
+    hashes its input image, so the cache is off unless enabled with this function.
+    Cached layouts are shared between callers and must not be mutated. The cache
+    covers get_layout, get_layouts and get_layouts_parallel; the first pass of
+    get_layout_and_features (get_all_tables with reuse_features) does not use it.
+
+    @params model: An instance of Detectron2LayoutModel for layout detection.
+    @params maxsize: The maximum number of layouts kept; 0 disables the cache.
+
+    @return: None
+    """
+    with _layout_cache_lock:
+        if maxsize > 0:
+            _layout_caches[model] = _LayoutCache(maxsize)
+        else:
+            _layout_caches.pop(model, None)
+
+def _image_key(image: np.ndarray) -> tuple:
+    """
+    Compute a cache key from the content of an image.
+
+    Strided views (e.g. crops) are hashed row by row, so they are not copied.
+
+    @params image: The input image.
+
+    @return: A tuple of the image's shape, dtype and content hash.
+    """
+    import xxhash  # Only needed once a layout cache is enabled
+
+    hasher = xxhash.xxh3_64()
+    if image.flags['C_CONTIGUOUS']:
+        hasher.update(image)
+    else:
+        for row in image:
+            hasher.update(np.ascontiguousarray(row))
+    return image.shape, image.dtype.str, hasher.hexdigest()
+
+def _cached_layout(cache: _LayoutCache, key: tuple) -> lp.Layout:
+    """
+    Look up a previously detected layout.
+
+    @params cache: The layout cache of the model.
+    @params key: The image key returned by _image_key.
+
+    @return: The cached layout, or None if the image has not been seen.
+    """
+    with _layout_cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+def _cache_layout(cache: _LayoutCache, key: tuple, layout: lp.Layout) -> None:
+    """
+    Store a detected layout, evicting the least recently used one when the cache is full.
+
+    @params cache: The layout cache of the model.
+    @params key: The image key returned by _image_key.
+    @params layout: The detected layout.
+
+    @return: None
+    """
+    with _layout_cache_lock:
+        cache[key] = layout
+        if len(cache) > cache.maxsize:
+            cache.popitem(last=False)
+
+def autocast(model: lp.models.Detectron2LayoutModel) -> torch.autocast:
+    """
+    Get the mixed-precision context to run the model in.
+
+    @params model: An instance of Detectron2LayoutModel for layout detection.
+
+    @return: An FP16 autocast context, enabled only if the model was initialized with fp16 on a GPU.
+    """
+    return torch.autocast('cuda', dtype=torch.float16, enabled=getattr(model, 'fp16', False))
+
 def get_layout(model: lp.models.Detectron2LayoutModel, image: np.ndarray) -> lp.Layout:
     """
     Detect the layout in the provided image using the given model.
 
+    The image is passed to the model without copying, so callers must not mutate
+    it while detection is running. If enable_layout_cache was called for the model,
+    images seen before return their cached (shared) layout.
+
     @params model: An instance of Detectron2LayoutModel for layout detection.
     @params image: The input image in which layout needs to be detected.
 
     @return: The detected layout in the image.
     """
-    image_copy = image.copy()
-    layout = model.detect(image_copy)
+    cache = _layout_caches.get(model)
+    if cache is None:
+        with autocast(model):
+            return model.detect(image)
+
+    key = _image_key(image)
+    layout = _cached_layout(cache, key)
+    if layout is None:
+        with autocast(model):
+            layout = model.detect(image)
+        _cache_layout(cache, key, layout)
     return layout
 
-def get_candidate_blocks(layout: lp.Layout, image: np.ndarray, space_margin: int = 0, block_type: str = 'Table') -> list[tuple[np.ndarray, BoundingBox]]:
+def _prepare_input(predictor, image: np.ndarray) -> dict:
+    """
+    Preprocess an image into a Detectron2 model input, as the model's predictor does.
+
+    @params predictor: The DefaultPredictor wrapped by the layout model.
+    @params image: The input image in BGR format.
+
+    @return: A dict with the resized image tensor and the original height and width.
+    """
+    if predictor.input_format == 'RGB':
+        image = image[:, :, ::-1]
+    height, width = image.shape[:2]
+    resized = predictor.aug.get_transform(image).apply_image(image)
+    tensor = torch.as_tensor(resized.astype('float32').transpose(2, 0, 1))
+    return {'image': tensor, 'height': height, 'width': width}
+
+def has_separable_roi_heads(model: lp.models.Detectron2LayoutModel) -> bool:
+    """
+    Check whether the backbone and ROI heads of the model can be run separately.
+
+    @params model: An instance of Detectron2LayoutModel for layout detection.
+
+    @return: True if the model wraps a two-stage Detectron2 network with a predictor.
+    """
+    predictor = model.model
+    network = getattr(predictor, 'model', None)
+    return (hasattr(predictor, 'aug') and
+            all(hasattr(network, attr) for attr in ('backbone', 'proposal_generator', 'roi_heads')))
+
+def get_layout_and_features(model: lp.models.Detectron2LayoutModel, image: np.ndarray) -> tuple[lp.Layout, object, dict]:
+    """
+    Detect the layout in the provided image and keep the backbone features.
+
+    @params model: An instance of Detectron2LayoutModel whose ROI heads are separable.
+    @params image: The input image in which layout needs to be detected.
+
+    @return: A tuple (layout, images, features) of the detected layout, the preprocessed
+             ImageList and the backbone's FPN feature maps for the whole image.
+    """
+    network = model.model.model
+    batched_inputs = [_prepare_input(model.model, image)]
+    with torch.no_grad(), autocast(model):
+        images = network.preprocess_image(batched_inputs)
+        features = network.backbone(images.tensor)
+        proposals, _ = network.proposal_generator(images, features, None)
+        instances, _ = network.roi_heads(images, features, proposals, None)
+
+    result = detector_postprocess(instances[0], image.shape[0], image.shape[1])
+    return model.gather_output({'instances': result}), images, features
+
+def get_layouts(model: lp.models.Detectron2LayoutModel, images: list[np.ndarray], batch_size: int = 8) -> list[lp.Layout]:
+    """
+    Detect the layouts of several images with batched forward passes of the model.
+
+    The images are preprocessed the same way the model's predictor would handle a
+    single image, then sent through the underlying Detectron2 network in chunks of
+    at most batch_size images. If the model does not expose a batchable predictor,
+    or a chunk does not fit in GPU memory, the images are detected one at a time.
+    With enable_layout_cache, images whose layout is cached are not sent through the network.
+
+    @params model: An instance of Detectron2LayoutModel for layout detection.
+    @params images: The input images in which layouts need to be detected.
+    @params batch_size: The maximum number of images sent through the network at once.
+
+    @return: A list with the detected layout of each image, in input order.
+    """
+    predictor = model.model
+    if not (hasattr(predictor, 'aug') and hasattr(predictor, 'model')):
+        return [get_layout(model, image) for image in images]
+
+    cache = _layout_caches.get(model)
+    if cache is None:
+        keys = [None] * len(images)
+        layouts = [None] * len(images)
+    else:
+        keys = [_image_key(image) for image in images]
+        layouts = [_cached_layout(cache, key) for key in keys]
+    missing = [i for i, layout in enumerate(layouts) if layout is None]
+
+    for start in range(0, len(missing), batch_size):
+        chunk = missing[start:start + batch_size]
+        batched_inputs = [_prepare_input(predictor, images[i]) for i in chunk]
+
+        try:
+            with torch.no_grad(), autocast(model):
+                outputs = predictor.model(batched_inputs)
+        except RuntimeError as e:
+            if 'out of memory' not in str(e):
+                raise
+            torch.cuda.empty_cache()
+            for i in chunk:
+                layouts[i] = get_layout(model, images[i])
+            continue
+
+        for i, output in zip(chunk, outputs):
+            layouts[i] = model.gather_output(output)
+            if cache is not None:
+                _cache_layout(cache, keys[i], layouts[i])
+
+    return layouts
+
+def get_layouts_parallel(model: lp.models.Detectron2LayoutModel, images: list[np.ndarray], max_workers: int = None) -> list[lp.Layout]:
+    """
+    Detect the layouts of several images with concurrent calls to the model.
+
+    Useful when the images differ too much in size to be batched: the Python
+    post-processing of one image overlaps with the model running on the next. When the
+    model runs on a GPU, each worker thread submits its work on its own CUDA stream.
+
+    @params model: An instance of Detectron2LayoutModel for layout detection.
+    @params images: The input images in which layouts need to be detected.
+    @params max_workers: The number of worker threads (defaults to min(4, CPU count)).
+
+    @return: A list with the detected layout of each image, in input order.
+    """
+    if max_workers is None:
+        max_workers = min(4, os.cpu_count() or 1)
+    local = threading.local()
+
+    # Streams only help if the model itself runs on a GPU, not merely if one is present
+    network = getattr(model.model, 'model', None)
+    device = next(network.parameters()).device if isinstance(network, torch.nn.Module) else None
+    on_gpu = device is not None and device.type == 'cuda'
+
+    def detect(image: np.ndarray) -> lp.Layout:
+        if not on_gpu:
+            return get_layout(model, image)
+        if not hasattr(local, 'stream'):
+            local.stream = torch.cuda.Stream(device=device)
+        with torch.cuda.stream(local.stream):
+            layout = get_layout(model, image)
+        local.stream.synchronize()
+        return layout
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(detect, images))
+
+def get_candidate_blocks(layout: lp.Layout, image: np.ndarray, space_margin: int = 0, block_type: str = 'Table', high_conf_skip: float = None, min_redetect_area: int = MIN_REDETECT_AREA, final_boxes: BoundingBoxes = None, score_thresh: float = 0.0) -> list[tuple[np.ndarray, BoundingBox]]:
     """
     Extract candidate blocks (e.g., tables) from the layout.
 
+    Blocks scoring above high_conf_skip whose area is below min_redetect_area cannot
+    gain anything from a second pass. When high_conf_skip is given, such blocks are
+    added to final_boxes as they are instead of becoming candidates. Since they skip
+    the second-pass filtering, they must also score above score_thresh.
+
+    The cropped images are views into the input image, so callers must not mutate
+    it while the candidate blocks are in use.
+
     @params layout: The detected layout from which to extract blocks.
     @params image: The input image from which blocks are to be extracted.
     @params space_margin: Margin around the detected block to include in the cropping.
     @params block_type: The type of block to extract (e.g., 'Table').
+    @params high_conf_skip: Score above which small blocks skip the second pass (optional).
+    @params min_redetect_area: Area in pixels below which confident blocks skip the second pass.
+    @params final_boxes: A BoundingBoxes object collecting the blocks that skip the second pass
+                         (required when high_conf_skip is given).
+    @params score_thresh: Score threshold applied to the blocks that skip the second pass.
 
     @return: A list of tuples containing cropped images and their associated BoundingBox objects.
     """
-    image_copy = image.copy()
-    image_x1, image_y1, image_x2, image_y2 = 0, 0, image.shape[1], image.shape[0]
-    candidate_blocks = []
+    if high_conf_skip is not None and final_boxes is None:
+        raise ValueError("final_boxes is required when high_conf_skip is given")
+
+    height, width = image.shape[:2]
+    block_coords = []
 
     for block in layout:
         if block.type != block_type:
             continue
         
         box_info = block.to_dict()
-        x_1 = max(math.floor(box_info['x_1'] - space_margin), image_x1)
-        y_1 = max(math.floor(box_info['y_1'] - space_margin), image_y1)
-        x_2 = min(math.ceil(box_info['x_2'] + space_margin), image_x2)
-        y_2 = min(math.ceil(box_info['y_2'] + space_margin), image_y2)
-        
-        cropped_image = image_copy[y_1:y_2, x_1:x_2]
+        if high_conf_skip is not None and block.score > max(high_conf_skip, score_thresh):
+            area = (box_info['x_2'] - box_info['x_1']) * (box_info['y_2'] - box_info['y_1'])
+            if area < min_redetect_area:
+                final_boxes.add_box(BoundingBox(box_info['x_1'], box_info['y_1'], box_info['x_2'], box_info['y_2'], block.score))
+                continue
+
+        block_coords.append([box_info['x_1'], box_info['y_1'], box_info['x_2'], box_info['y_2']])
+
+    # Add the margin, round outwards and clamp to the image for all blocks at once
+    coords = np.array(block_coords, dtype=np.float64).reshape(-1, 4) + [-space_margin, -space_margin, space_margin, space_margin]
+    coords = np.hstack([np.floor(coords[:, :2]), np.ceil(coords[:, 2:])])
+    coords = np.clip(coords, 0, [width, height, width, height]).astype(int)
+
+    candidate_blocks = []
+    for x_1, y_1, x_2, y_2 in coords.tolist():
+        cropped_image = image[y_1:y_2, x_1:x_2]
         candidate_rect = BoundingBox(x_1, y_1, x_2, y_2)
         candidate_blocks.append((cropped_image, candidate_rect))
 
     return candidate_blocks
 
-def double_detection(model: lp.models.Detectron2LayoutModel, candidate_blocks: list[tuple[np.ndarray, BoundingBox]], score_thresh: float = 0.5, space_margin: int = 0) -> BoundingBoxes:
+def double_detection(model: lp.models.Detectron2LayoutModel, candidate_blocks: list[tuple[np.ndarray, BoundingBox]], score_thresh: float = 0.5, space_margin: int = 0, batch_size: int = 8, parallel: bool = False, max_workers: int = None) -> BoundingBoxes:
     """
     Perform a second pass of detection on candidate blocks.
 
@@ -55,28 +334,79 @@ def double_detection(model: lp.models.Detectron2LayoutModel, candidate_blocks: l
     @params candidate_blocks: A list of tuples containing candidate block images and their associated BoundingBox objects.
     @params score_thresh: Score threshold for filtering the detected blocks.
     @params space_margin: Margin around the detected block to include in the cropping.
+    @params batch_size: The maximum number of candidate blocks detected in one forward pass.
+    @params parallel: Whether to detect the candidate blocks concurrently instead of in batches.
+    @params max_workers: The number of worker threads used when parallel is set.
 
     @return: A BoundingBoxes object containing all BoundingBox objects with absolute coordinates and scores.
     """
     all_boxes = BoundingBoxes()
-    
-    for block, block_rect in candidate_blocks:
-        layout = get_layout(model, block)
-        filtered_layout = [block for block in layout if block.score > score_thresh]
-        
-        for table in filtered_layout:
-            # Get the bounding box coordinates relative to the candidate block
-            rel_coords = [table.block.x_1, table.block.y_1, table.block.x_2, table.block.y_2]
-            
-            # Create a BoundingBox from relative coordinates
-            box = BoundingBox.from_relative(rel_coords, block_rect.to_list(), table.score)
-            
-            # Add the BoundingBox object to the BoundingBoxes collection
-            all_boxes.add_box(box)
+    blocks = [block for block, _ in candidate_blocks]
+    if parallel:
+        layouts = get_layouts_parallel(model, blocks, max_workers)
+    else:
+        layouts = get_layouts(model, blocks, batch_size)
+
+    for (_, block_rect), layout in zip(candidate_blocks, layouts):
+        block_x, block_y = block_rect.x1, block_rect.y1
+        if not layout:
+            continue
+
+        # Stack the bounding box coordinates relative to the candidate block
+        rel_coords = np.fromiter(
+            (v for table in layout for v in (table.block.x_1, table.block.y_1, table.block.x_2, table.block.y_2)),
+            dtype=np.float64, count=4 * len(layout)
+        ).reshape(-1, 4)
+        scores = np.fromiter((table.score for table in layout), dtype=np.float64, count=len(layout))
+
+        # Filter the detections by score with a single mask
+        keep = scores > score_thresh
+        rel_coords, scores = rel_coords[keep], scores[keep]
+
+        # Translate all boxes to absolute coordinates at once and add them to the collection
+        all_boxes.add_boxes(BoundingBoxes.from_relative(rel_coords, (block_x, block_y), scores))
 
     return all_boxes
 
-def get_all_tables(model: lp.models.Detectron2LayoutModel, image: np.ndarray, score_thresh: float = 0.5, space_margin: int = 0, block_type: str = 'Table') -> BoundingBoxes:
+def double_detection_from_features(model: lp.models.Detectron2LayoutModel, images, features: dict, candidate_blocks: list[tuple[np.ndarray, BoundingBox]], image_size: tuple[int, int], score_thresh: float = 0.5) -> BoundingBoxes:
+    """
+    Perform the second pass of detection on candidate blocks by reusing the backbone features.
+
+    Instead of running the whole network again on each crop, every candidate block is
+    used as a proposal for the ROI heads on the feature maps of the full image.
+
+    @params model: An instance of Detectron2LayoutModel whose ROI heads are separable.
+    @params images: The preprocessed ImageList returned by get_layout_and_features.
+    @params features: The backbone feature maps returned by get_layout_and_features.
+    @params candidate_blocks: A list of tuples containing candidate block images and their associated BoundingBox objects.
+    @params image_size: The (height, width) of the original image.
+    @params score_thresh: Score threshold for filtering the detected blocks.
+
+    @return: A BoundingBoxes object containing all BoundingBox objects with absolute coordinates and scores.
+    """
+    if not candidate_blocks:
+        return BoundingBoxes()
+
+    network = model.model.model
+    height, width = image_size
+    input_height, input_width = images.image_sizes[0]
+    scale = np.array([input_width / width, input_height / height] * 2, dtype=np.float32)
+    block_coords = np.array([block_rect.to_list() for _, block_rect in candidate_blocks], dtype=np.float32) * scale
+
+    proposals = Instances(images.image_sizes[0])
+    proposals.proposal_boxes = Boxes(torch.as_tensor(block_coords, device=images.tensor.device))
+    proposals.objectness_logits = torch.ones(len(block_coords), device=images.tensor.device)
+    with torch.no_grad(), autocast(model):
+        instances, _ = network.roi_heads(images, features, [proposals], None)
+
+    # Read the detections straight from the Instances tensors without building a layout
+    result = detector_postprocess(instances[0], height, width).to('cpu')
+    coords = result.pred_boxes.tensor.float().numpy()
+    scores = result.scores.float().numpy()
+    keep = scores > score_thresh
+    return BoundingBoxes(coords=coords[keep], scores=scores[keep])
+
+def get_all_tables(model: lp.models.Detectron2LayoutModel, image: np.ndarray, score_thresh: float = 0.5, space_margin: int = 0, block_type: str = 'Table', batch_size: int = 8, reuse_features: bool = False, parallel: bool = False, high_conf_skip: float = None) -> BoundingBoxes:
     """
     Retrieve all tables from the input image using the model.
 
@@ -85,11 +415,28 @@ def get_all_tables(model: lp.models.Detectron2LayoutModel, image: np.ndarray, sc
     @params score_thresh: Score threshold for filtering the detected blocks.
     @params space_margin: Margin around the detected block to include in the cropping.
     @params block_type: The type of block to extract (e.g., 'Table').
+    @params batch_size: The maximum number of candidate blocks detected in one forward pass.
+    @params reuse_features: Whether the second pass reuses the backbone features of the
+                            first pass instead of running the model on each crop. Ignored
+                            when the model's ROI heads cannot be run separately.
+    @params parallel: Whether to detect the candidate blocks concurrently instead of in batches.
+    @params high_conf_skip: Score above which blocks smaller than MIN_REDETECT_AREA are kept
+                            from the first pass without a second detection (optional, e.g. 0.9).
 
     @return: A BoundingBoxes object containing all BoundingBox objects with absolute coordinates and scores.
     """
-    layout = get_layout(model, image)
-    candidate_blocks = get_candidate_blocks(layout, image, space_margin, block_type)
-    all_boxes = double_detection(model, candidate_blocks, score_thresh, space_margin)
+    final_boxes = BoundingBoxes()
+
+    if reuse_features and has_separable_roi_heads(model):
+        layout, images, features = get_layout_and_features(model, image)
+        candidate_blocks = get_candidate_blocks(layout, image, space_margin, block_type, high_conf_skip, final_boxes=final_boxes, score_thresh=score_thresh)
+        all_boxes = double_detection_from_features(model, images, features, candidate_blocks, image.shape[:2], score_thresh)
+    else:
+        layout = get_layout(model, image)
+        candidate_blocks = get_candidate_blocks(layout, image, space_margin, block_type, high_conf_skip, final_boxes=final_boxes, score_thresh=score_thresh)
+        all_boxes = double_detection(model, candidate_blocks, score_thresh, space_margin, batch_size, parallel)
+
+    # Add the blocks that skipped the second pass
+    all_boxes.add_boxes(final_boxes)
     
     return all_boxes
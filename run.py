@@ -1,18 +1,30 @@
 import cv2
+import math
+from concurrent.futures import ThreadPoolExecutor
+from bounding_box import BoundingBox
 from double_detection import get_all_tables
-from utils import initialize_model
+from utils import initialize_model, write_jpeg
 
-def main(image_path: str, output_dir: str, score_thresh: float = 0.5, space_margin: int = 0):
+REDUCED_READ_FLAGS: dict = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+MIN_DOWNSCALE_SIZE: int = 2000
+
+def main(image_path: str, output_dir: str, score_thresh: float = 0.5, space_margin: int = 0, downscale_for_detect: int = 1):
     """
     Main function to detect tables, print their information, and save cropped images.
 
     @params image_path: Path to the input image.
     @params output_dir: Directory to save the cropped table images.
     @params score_thresh: Score threshold for filtering the detected blocks.
-    @params space_margin: Margin around the detected block to include in the cropping.
+    @params space_margin: Margin (in full-resolution pixels) around the detected block to include in the cropping.
+    @params downscale_for_detect: Factor (1, 2, 4 or 8) by which images larger than
+                                  MIN_DOWNSCALE_SIZE on their short side are reduced at load
+                                  time for detection. Tables are still cropped at full resolution.
 
     @return: None
     """
+    if downscale_for_detect != 1 and downscale_for_detect not in REDUCED_READ_FLAGS:
+        raise ValueError(f"downscale_for_detect must be 1, 2, 4 or 8, got {downscale_for_detect}")
+
     # Initialize the model
     model = initialize_model()
 
@@ -22,24 +34,43 @@ def main(image_path: str, output_dir: str, score_thresh: float = 0.5, space_marg
         print(f"Error: Unable to load image from {image_path}")
         return
 
-    # Get all detected tables as BoundingBoxes object
-    bounding_boxes = get_all_tables(model, image, score_thresh, space_margin)
+    # Decode a reduced image for detection when the full resolution is not needed
+    detect_image, scale = image, 1
+    if downscale_for_detect in REDUCED_READ_FLAGS and min(image.shape[:2]) > MIN_DOWNSCALE_SIZE:
+        reduced_image = cv2.imread(image_path, REDUCED_READ_FLAGS[downscale_for_detect])
+        if reduced_image is None:
+            print(f"Warning: Unable to load reduced image from {image_path}, detecting at full resolution")
+        else:
+            detect_image, scale = reduced_image, downscale_for_detect
+
+    # Get all detected tables as BoundingBoxes object, with the margin in detection pixels
+    detect_margin = math.ceil(space_margin / scale)
+    bounding_boxes = get_all_tables(model, detect_image, score_thresh, detect_margin)
 
     # Merge intersecting bounding boxes
     bounding_boxes.merge_intersection()
 
-    # Process each unique detected BoundingBox
-    for i, box in enumerate(bounding_boxes.get_all_boxes()):
-        # Print the BoundingBox object information
+    # Map the boxes back to the full-resolution image
+    if scale != 1:
+        bounding_boxes.scale(scale)
+
+    boxes = list(bounding_boxes.get_all_boxes())
+
+    # Print the information of each unique detected BoundingBox
+    for i, box in enumerate(boxes):
         print(f"BoundingBox {i+1}: {box}")
-        
-        # Crop the image using the BoundingBox
-        cropped_image = box.crop_image(image)
-        
-        # Save the cropped image
+
+    def save_crop(i_box: tuple[int, BoundingBox]) -> str:
+        # Crop the image using the BoundingBox and save it
+        i, box = i_box
         output_path = f"{output_dir}/cropped_table_{i+1}.jpg"
-        cv2.imwrite(output_path, cropped_image)
-        print(f"Saved cropped table {i+1} to {output_path}")
+        write_jpeg(output_path, box.crop_image(image))
+        return output_path
+
+    # JPEG encoding releases the GIL, so the crops are saved in parallel
+    with ThreadPoolExecutor() as executor:
+        for i, output_path in enumerate(executor.map(save_crop, enumerate(boxes))):
+            print(f"Saved cropped table {i+1} to {output_path}")
 
 if __name__ == "__main__":
     # Example usage
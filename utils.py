@@ -1,15 +1,30 @@
 import os
 import cv2
+import numpy as np
+import torch
 import layoutparser as lp
+from utils_jit import warmup
+
+try:
+    from turbojpeg import TJSAMP_420, TurboJPEG
+    TURBOJPEG = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    TURBOJPEG = None
 
 MODEL_NAME: str = 'lp://TableBank/faster_rcnn_R_101_FPN_3x/config'
 LABEL_MAP: dict = {0: "Table"}
 SCORE_THRESH: float = 0.05
+JPEG_QUALITY: int = 95
 
-def initialize_model() -> lp.models.Detectron2LayoutModel:
+def initialize_model(fp16: bool = True, quantize_box_head: bool = False) -> lp.models.Detectron2LayoutModel:
     """
     Initialize the Detectron2LayoutModel with the given configuration.
 
+    @params fp16: Whether to run detection in FP16 mixed precision (only used on GPU).
+    @params quantize_box_head: Whether to quantize the fully connected layers of the ROI box head
+                              to INT8 (only used on CPU). The backbone, RPN and box predictor
+                              stay in FP32.
+
     @return: A Detectron2LayoutModel initialized with the specified config and label map.
     """
     model = lp.models.Detectron2LayoutModel(
@@ -17,8 +32,37 @@ def initialize_model() -> lp.models.Detectron2LayoutModel:
         label_map=LABEL_MAP,
         extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", SCORE_THRESH]
     )
+    # Detection functions read this flag to run the model under FP16 autocast
+    model.fp16 = fp16 and torch.cuda.is_available()
+    if quantize_box_head and not torch.cuda.is_available():
+        # Only the box head's FC layers; the box predictor keeps FP32 weights for the regression deltas
+        roi_heads = model.model.model.roi_heads
+        roi_heads.box_head = torch.ao.quantization.quantize_dynamic(roi_heads.box_head, {torch.nn.Linear}, dtype=torch.qint8)
+    # Compile the box-merging kernel now so the first detection does not pay for it
+    warmup()
     return model
 
+def write_jpeg(path: str, image: np.ndarray) -> None:
+    """
+    Encode an image as JPEG and write it to the given path.
+
+    Uses libjpeg-turbo through PyTurboJPEG when it is installed, otherwise OpenCV.
+    Both use JPEG_QUALITY and 4:2:0 chroma subsampling, OpenCV's default.
+
+    @params path: The path of the output file.
+    @params image: The image in BGR format, possibly a strided view (e.g. a crop).
+
+    @return: None
+    """
+    if TURBOJPEG is not None:
+        encoded = TURBOJPEG.encode(np.ascontiguousarray(image), quality=JPEG_QUALITY, jpeg_subsample=TJSAMP_420)
+    else:
+        success, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not success:
+            raise ValueError(f"Unable to encode image as JPEG for {path}")
+    with open(path, 'wb') as f:
+        f.write(encoded)
+
 def save_all_tables(all_tables: list, path: str) -> None:
     """
     Save all detected tables as images in the specified directory.
@@ -32,4 +76,4 @@ def save_all_tables(all_tables: list, path: str) -> None:
         os.makedirs(path)
     
     for i, table in enumerate(all_tables):
-        cv2.imwrite(os.path.join(path, f"table_{i}.jpg"), table)
+        write_jpeg(os.path.join(path, f"table_{i}.jpg"), table)
@@ -0,0 +1,123 @@
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE: bool = True
+except ImportError:
+    NUMBA_AVAILABLE: bool = False
+
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit when numba is not installed: returns the function unchanged.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True, fastmath=True)
+def _sweep_merge_kernel(coords: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge intersecting boxes with a single sweep along the x-axis.
+
+    @params coords: An (N, 4) float64 array of [x1, y1, x2, y2] rows.
+    @params scores: An (N,) float64 array of confidence scores.
+
+    @return: A tuple (coords, scores) of the boxes left after the sweep, ordered by
+             the first input position among each box's members.
+    """
+    n = coords.shape[0]
+    order = np.argsort(coords[:, 0], kind='mergesort')
+    boxes = coords[order].copy()
+    box_scores = scores[order].copy()
+    box_first = order.copy()   # smallest input position among the members of each box
+
+    out_coords = np.empty((n, 4), dtype=np.float64)
+    out_scores = np.empty(n, dtype=np.float64)
+    out_first = np.empty(n, dtype=np.int64)
+    num_out = 0
+    active = np.empty(n, dtype=np.int64)
+    num_active = 0
+
+    for i in range(n):
+        x1, y1, x2, y2 = boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3]
+        score = box_scores[i]
+        first = box_first[i]
+
+        # Boxes ending left of the sweep line can never intersect anything further right
+        k = 0
+        while k < num_active:
+            j = active[k]
+            if boxes[j, 2] < x1:
+                out_coords[num_out] = boxes[j]
+                out_scores[num_out] = box_scores[j]
+                out_first[num_out] = box_first[j]
+                num_out += 1
+                num_active -= 1
+                active[k] = active[num_active]
+            else:
+                k += 1
+
+        # Every active box overlaps the sweep line, so only the y-extent needs testing
+        grew = True
+        while grew:
+            grew = False
+            k = 0
+            while k < num_active:
+                j = active[k]
+                if y1 <= boxes[j, 3] and y2 >= boxes[j, 1]:
+                    x1 = min(x1, boxes[j, 0])
+                    y1 = min(y1, boxes[j, 1])
+                    x2 = max(x2, boxes[j, 2])
+                    y2 = max(y2, boxes[j, 3])
+                    score = max(score, box_scores[j])
+                    first = min(first, box_first[j])
+                    num_active -= 1
+                    active[k] = active[num_active]
+                    grew = True
+                else:
+                    k += 1
+
+        boxes[i, 0], boxes[i, 1], boxes[i, 2], boxes[i, 3] = x1, y1, x2, y2
+        box_scores[i] = score
+        box_first[i] = first
+        active[num_active] = i
+        num_active += 1
+
+    for k in range(num_active):
+        out_coords[num_out] = boxes[active[k]]
+        out_scores[num_out] = box_scores[active[k]]
+        out_first[num_out] = box_first[active[k]]
+        num_out += 1
+
+    # Emit the boxes in first-appearance order rather than in sweep order
+    emit_order = np.argsort(out_first[:num_out])
+    return out_coords[emit_order], out_scores[emit_order]
+
+
+@njit(cache=True, fastmath=True)
+def merge_intersect_kernel(coords: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Merge intersecting boxes until no further intersections are found.
+
+    @params coords: An (N, 4) float64 array of [x1, y1, x2, y2] rows.
+    @params scores: An (N,) float64 array of confidence scores.
+
+    @return: A tuple (coords, scores) of the non-intersecting merged boxes, in the order
+             of their first member in the input.
+    """
+    while coords.shape[0] > 1:
+        num_boxes = coords.shape[0]
+        coords, scores = _sweep_merge_kernel(coords, scores)
+        if coords.shape[0] == num_boxes:
+            break
+    return coords, scores
+
+
+def warmup() -> None:
+    """
+    Compile the JIT kernels ahead of the first real call.
+
+    @return: None
+    """
+    merge_intersect_kernel(np.zeros((2, 4), dtype=np.float64), np.zeros(2, dtype=np.float64))